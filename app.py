@@ -1,17 +1,204 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, Response, stream_with_context
+from flask.sessions import SessionInterface
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user, UserMixin
-from io import BytesIO
-import json
+from jinja2 import ChoiceLoader, FileSystemBytecodeCache, ModuleLoader
+from markupsafe import Markup
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import db as DB
 import os
+import re
+import stat
+
+try:
+    from flask_compress import Compress  # optional: gzip/brotli responses
+except ImportError:
+    Compress = None
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("CLASSROOM_SECRET", "dev-secret-change-me")
+# match "/tutor/" and "/tutor" alike instead of answering with a redirect
+app.url_map.strict_slashes = False
+
+# -----------------------
+# Response compression
+# -----------------------
+# dashboards and results pages are large, highly repetitive HTML
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+app.config["COMPRESS_MIN_SIZE"] = 500
+app.config["COMPRESS_LEVEL"] = 6
+# only what this app serves. text/csv is deliberately left out: Flask-Compress
+# buffers the whole body via get_data(), which would undo the streamed exports
+app.config["COMPRESS_MIMETYPES"] = [
+    "text/html", "text/css", "text/javascript", "application/json",
+]
+app.config["COMPRESS_STREAMS"] = False
+if Compress is not None:
+    Compress(app)
+
+# -----------------------
+# Session handling
+# -----------------------
+class StaticRequestFilteringSessionInterface(SessionInterface):
+    """Hand static file requests a null session so they skip cookie signing/parsing."""
+
+    def __init__(self, app):
+        self.default_session_interface = app.session_interface
+        self.static_prefix = app.static_url_path + "/"
+
+    def open_session(self, app, request):
+        if request.path.startswith(self.static_prefix):
+            return self.make_null_session(app)
+        return self.default_session_interface.open_session(app, request)
+
+    def save_session(self, app, sess, response):
+        return self.default_session_interface.save_session(app, sess, response)
+
+app.session_interface = StaticRequestFilteringSessionInterface(app)
+
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 
+# -----------------------
+# Per-request DB connection
+# -----------------------
+@app.before_request
+def open_db_scope():
+    DB.open_request_scope()
+
+@app.teardown_request
+def close_db_scope(exc):
+    DB.close_request_scope()
+
+# Bring the database up to SCHEMA_VERSION however the app is started
+# (`flask run`, gunicorn, ...); once current this is a single PRAGMA read.
+DB.init_db()
+
+# -----------------------
+# Jinja template caching
+# -----------------------
+# Persist compiled template bytecode so fresh workers skip lex/parse/compile.
+# Flask already ties auto_reload (mtime checks) to debug mode.
+# Cached bytecode is executed on load, so the directory must be private to
+# this user. Without CLASSROOM_JINJA_CACHE, Jinja picks (and checks) its own
+# per-uid, mode-0700 directory under the temp dir.
+JINJA_CACHE_DIR = os.environ.get("CLASSROOM_JINJA_CACHE")
+
+def _private_cache_dir(path):
+    """Create `path` with mode 0700 and refuse it unless the current user owns it."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise RuntimeError(f"CLASSROOM_JINJA_CACHE={path!r} is not a directory owned by this user")
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+if JINJA_CACHE_DIR:
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(_private_cache_dir(JINJA_CACHE_DIR))
+else:
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
+# Optional ahead-of-time build (`flask compile-templates`): when the env var
+# points at the archive, templates are imported as Python modules and never
+# parsed at runtime; anything missing from it falls back to templates/.
+COMPILED_TEMPLATES = os.environ.get("CLASSROOM_COMPILED_TEMPLATES")
+_file_loader = app.jinja_env.loader
+if COMPILED_TEMPLATES and os.path.exists(COMPILED_TEMPLATES):
+    app.jinja_env.loader = ChoiceLoader([ModuleLoader(COMPILED_TEMPLATES), _file_loader])
+
+def warm_template_cache():
+    """Compile every template up front so no request pays for the first parse."""
+    for name in _file_loader.list_templates():
+        app.jinja_env.get_template(name)
+
+warm_template_cache()
+
+# -----------------------
+# Password hashing
+# -----------------------
+# Explicit scrypt cost instead of werkzeug's version-dependent default
+# (pbkdf2 with hundreds of thousands of iterations on older releases).
+PASSWORD_HASH_METHOD = os.environ.get("CLASSROOM_PW_METHOD", "scrypt:32768:8:1")
+# hashlib's scrypt/pbkdf2 release the GIL, so hashing on a pool sized to the
+# cores lets other request threads progress and caps concurrent hash work.
+HASH_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="pwhash")
+
+def hash_password(password):
+    return HASH_POOL.submit(generate_password_hash, password, method=PASSWORD_HASH_METHOD).result()
+
+def verify_password(pw_hash, password):
+    return HASH_POOL.submit(check_password_hash, pw_hash, password).result()
+
+# checked against when the email is unknown, so that path costs the same hash
+# work as a real login and response time doesn't reveal which accounts exist
+DUMMY_HASH = generate_password_hash(os.urandom(16).hex(), method=PASSWORD_HASH_METHOD)
+
+# werkzeug normalises the method string (e.g. "scrypt" -> "scrypt:32768:8:1"),
+# so compare against the prefix it actually writes, not the raw setting
+PASSWORD_HASH_PREFIX = DUMMY_HASH.split("$", 1)[0]
+
+def needs_rehash(pw_hash):
+    return pw_hash.split("$", 1)[0] != PASSWORD_HASH_PREFIX
+
+# -----------------------
+# Helpers
+# -----------------------
+def csv_response(lines, filename):
+    """Stream CSV lines to the client as a download instead of buffering the file."""
+    return Response(
+        stream_with_context(lines),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+ALLOWED_EXTENSIONS = {"json"}
+# quiz uploads are small JSON documents; checked in tutor_upload_quiz only
+QUIZ_UPLOAD_MAX_BYTES = 2 * 1024 * 1024
+_ALLOWED_FILE_RE = re.compile(r"\.(?:%s)\Z" % "|".join(map(re.escape, sorted(ALLOWED_EXTENSIONS))), re.IGNORECASE)
+
+def allowed_file(filename):
+    return _ALLOWED_FILE_RE.search(filename) is not None
+
+@lru_cache(maxsize=4096)
+def render_choices_html(question_id, choices_json):
+    """Radio inputs for one question, keyed by its stored choices JSON text.
+
+    The text is always hashable, whatever the choices contain, and an edited
+    question gets a new key, so each version renders once.
+    """
+    choices = DB.json_loads(choices_json)
+    return Markup("").join(
+        Markup(
+            '<label class="flex items-center gap-2">'
+            '<input type="radio" name="q_{0}" value="{1}"/>'
+            '<span>{2}</span>'
+            '</label>'
+        ).format(question_id, i, choice)
+        for i, choice in enumerate(choices)
+    )
+
+@lru_cache(maxsize=1024)
+def render_nav(user_name, role):
+    """The header bar depends only on who is logged in, so render it once per user."""
+    return Markup(app.jinja_env.get_template("_nav.html").render(user_name=user_name, role=role))
+
+@app.context_processor
+def inject_nav():
+    if current_user.is_authenticated:
+        return {"nav_html": render_nav(current_user.name, current_user.role)}
+    return {"nav_html": render_nav(None, None)}
+
+def score_answers(questions, answers):
+    """Percentage score for answers (chosen index or None, one per question)."""
+    total_points = sum(q["points"] for q in questions)
+    if not total_points:
+        return 0.0
+    earned = sum(q["points"] for q, a in zip(questions, answers) if a == q["answer_index"])
+    return round((earned / total_points) * 100, 2)
+
 # -----------------------
 # Flask-Login User object
 # -----------------------
@@ -24,9 +211,14 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
+    # memoized on g so the user row is fetched at most once per request
+    cached = g.get("_cached_user")
+    if cached is not None and str(cached.id) == str(user_id):
+        return cached
     row = DB.get_user_by_id(int(user_id))
     if row:
-        return User(row)
+        g._cached_user = User(row)
+        return g._cached_user
     return None
 
 # -----------------------
@@ -41,14 +233,19 @@ def login():
     if request.method == "POST":
         email = request.form["email"].strip().lower()
         password = request.form["password"]
-        row = DB.get_user_by_email(email)
+        # only the lookup is cached; the password check below always runs
+        row = DB.get_user_by_email_cached(email)
         if not row:
+            verify_password(DUMMY_HASH, password)
             flash("Invalid credentials", "danger")
             return redirect(url_for("login"))
         if not row["password_hash"]:
             flash("Account exists but no password set. Ask admin to reset.", "danger")
             return redirect(url_for("login"))
-        if check_password_hash(row["password_hash"], password):
+        if verify_password(row["password_hash"], password):
+            # transparently upgrade hashes created with an older scheme/cost
+            if needs_rehash(row["password_hash"]):
+                DB.set_password_hash(row["id"], hash_password(password))
             user = User(row)
             login_user(user)
             flash("Logged in", "success")
@@ -95,7 +292,7 @@ def register():
             flash("Creating admin via UI is disabled", "danger")
             return redirect(url_for("register"))
 
-        pw_hash = generate_password_hash(password)
+        pw_hash = hash_password(password)
         try:
             uid = DB.create_user(name, email, pw_hash, role)
             flash(f"User {name} ({role}) created with id {uid}", "success")
@@ -137,7 +334,7 @@ def admin_register_tutor():
         email = request.form["email"].strip().lower()
         password = request.form["password"]
         # Force role to tutor (safety)
-        uid = DB.create_user(name, email, generate_password_hash(password), "tutor")
+        uid = DB.create_user(name, email, hash_password(password), "tutor")
         flash(f"Tutor {name} created (id: {uid})", "success")
         return redirect(url_for("index"))
 
@@ -154,26 +351,7 @@ def tutor_dashboard():
         flash("Forbidden","danger")
         return redirect(url_for("index"))
 
-    classes = DB.get_classes_for_tutor(current_user.id)
-    class_data = []
-    for c in classes:
-        students = DB.get_students_in_class(c["id"])
-        quizzes = DB.get_quizzes_for_class(c["id"])
-        attendance_summary = DB.get_attendance_summary(c["id"])
-        quiz_stats = [
-            {
-                "quiz": q,
-                "avg_score": DB.get_average_score(q["id"]),
-                "num_submissions": DB.count_submissions(q["id"])
-            }
-            for q in quizzes
-        ]
-        class_data.append({
-            "class": c,
-            "students": students,
-            "attendance": attendance_summary,
-            "quizzes": quiz_stats
-        })
+    class_data = DB.get_tutor_dashboard_bundle_cached(current_user.id)
     return render_template("tutor_dashboard.html", class_data=class_data)
 
 @app.route("/tutor/create_class", methods=["GET","POST"])
@@ -203,62 +381,67 @@ def tutor_enroll_student(class_id):
 def tutor_upload_quiz(class_id):
     if current_user.role != "tutor": flash("Forbidden","danger"); return redirect(url_for("index"))
     if request.method == "POST":
-        # expects form fields or JSON textarea
+        # refuse oversized bodies before the form is parsed
+        if (request.content_length or 0) > QUIZ_UPLOAD_MAX_BYTES:
+            flash("Quiz upload is too large (2 MiB max)", "danger")
+            return redirect(url_for("tutor_upload_quiz", class_id=class_id))
+        # expects an uploaded .json file, a JSON textarea, or form fields
         title = request.form["title"]
         description = request.form.get("description", "")
+        questions_file = request.files.get("questions_file")
         questions_json = request.form.get("questions_json", "")
-        if questions_json:
-            payload = json.loads(questions_json)
-        else:
-            # build from simple fields
-            payload = []
-            q_texts = request.form.getlist("question_text")
-            for idx, qt in enumerate(q_texts):
-                choices = request.form.getlist(f"choices_{idx}") or []
-                answer_index = int(request.form.get(f"answer_{idx}", 0))
-                pts = int(request.form.get(f"points_{idx}", 1))
-                payload.append({"question_text": qt, "choices": choices, "answer_index": answer_index, "points": pts})
-        DB.create_quiz(class_id, title, description, current_user.id, payload)
-        flash("Quiz created", "success")
-        return redirect(url_for("tutor_dashboard"))
+        if questions_file and questions_file.filename and not allowed_file(questions_file.filename):
+            flash("Only .json files can be uploaded", "danger")
+            return redirect(url_for("tutor_upload_quiz", class_id=class_id))
+        try:
+            if questions_file and questions_file.filename:
+                # parsed straight from the upload stream; nothing is written to disk
+                payload = DB.json_loads(questions_file.read())
+            elif questions_json:
+                payload = DB.json_loads(questions_json)
+            else:
+                # build from simple fields
+                payload = []
+                q_texts = request.form.getlist("question_text")
+                for idx, qt in enumerate(q_texts):
+                    choices = request.form.getlist(f"choices_{idx}") or []
+                    answer_index = int(request.form.get(f"answer_{idx}", 0))
+                    pts = int(request.form.get(f"points_{idx}", 1))
+                    payload.append({"question_text": qt, "choices": choices, "answer_index": answer_index, "points": pts})
+            DB.create_quiz(class_id, title, description, current_user.id, payload)
+            flash("Quiz created", "success")
+            return redirect(url_for("tutor_dashboard"))
+        except Exception as e:
+            flash(f"Invalid quiz: {e}", "danger")
+            return redirect(url_for("tutor_upload_quiz", class_id=class_id))
     return render_template("upload_quiz.html", class_id=class_id)
 
 @app.route("/tutor/quiz/<int:quiz_id>/edit", methods=["GET","POST"])
 @login_required
 def edit_quiz(quiz_id):
     if current_user.role != "tutor": flash("Forbidden","danger"); return redirect(url_for("index"))
-    data = DB.get_quiz(quiz_id)
-    if not data:
+    quiz = DB.get_quiz_row(quiz_id)
+    if not quiz:
         flash("Quiz not found", "danger"); return redirect(url_for("tutor_dashboard"))
-    quiz = data["quiz"]; questions = data["questions"]
     if request.method == "POST":
         title = request.form["title"]; desc = request.form.get("description","")
         # incoming questions as JSON in textarea for simplicity
         questions_json = request.form["questions_json"]
         try:
-            qlist = json.loads(questions_json)
+            qlist = DB.json_loads(questions_json)
             DB.update_quiz(quiz_id, title, desc, qlist)
             flash("Quiz updated", "success")
             return redirect(url_for("tutor_dashboard"))
         except Exception as e:
             flash(f"Invalid JSON: {e}", "danger")
-    # prepare questions for textarea
-    qlist = []
-    for q in questions:
-        qlist.append({
-            "question_text": q["question_text"],
-            "choices": json.loads(q["choices"]),
-            "answer_index": q["answer_index"],
-            "points": q["points"]
-        })
-    return render_template("edit_quiz.html", quiz=quiz, questions_json=json.dumps(qlist, indent=2))
+    # textarea payload is serialized once at write time (create/update_quiz)
+    return render_template("edit_quiz.html", quiz=quiz, questions_json=quiz["questions_json_pretty"])
 
 @app.route("/tutor/quiz/<int:quiz_id>/export_csv")
 @login_required
 def export_quiz_csv(quiz_id):
     if current_user.role != "tutor": flash("Forbidden","danger"); return redirect(url_for("index"))
-    csv = DB.export_submissions_csv(quiz_id)
-    return send_file(BytesIO(csv.encode()), download_name=f"quiz_{quiz_id}_submissions.csv", as_attachment=True)
+    return csv_response(DB.export_submissions_csv(quiz_id), f"quiz_{quiz_id}_submissions.csv")
 
 # Attendance
 @app.route("/tutor/<int:class_id>/attendance", methods=["GET","POST"])
@@ -268,12 +451,16 @@ def tutor_attendance(class_id):
     students = DB.get_students_in_class(class_id)
     if request.method == "POST":
         # expected form fields: status_<student_id> and reason_<student_id> optionally
+        statuses = {k[len("status_"):]: v for k, v in request.form.items() if k.startswith("status_")}
+        reasons = {k[len("reason_"):]: v for k, v in request.form.items() if k.startswith("reason_")}
+        entries = []
         for s in students:
             sid = s["id"]
-            status = request.form.get(f"status_{sid}")
-            reason = request.form.get(f"reason_{sid}", "").strip() if status == "justified" else None
+            status = statuses.get(str(sid))
+            reason = reasons.get(str(sid), "").strip() if status == "justified" else None
             if status:
-                DB.mark_attendance(class_id, sid, status, reason, current_user.id)
+                entries.append((sid, status, reason))
+        DB.mark_attendance_bulk(class_id, current_user.id, entries)
         flash("Attendance recorded", "success")
         return redirect(url_for("tutor_dashboard"))
     attendance = DB.get_attendance_for_class(class_id)
@@ -283,8 +470,7 @@ def tutor_attendance(class_id):
 @login_required
 def export_attendance(class_id):
     if current_user.role != "tutor": flash("Forbidden","danger"); return redirect(url_for("index"))
-    csv = DB.export_attendance_csv(class_id)
-    return send_file(BytesIO(csv.encode()), download_name=f"attendance_class_{class_id}.csv", as_attachment=True)
+    return csv_response(DB.export_attendance_csv(class_id), f"attendance_class_{class_id}.csv")
 
 # -----------------------
 # Student features
@@ -314,18 +500,9 @@ def take_quiz(quiz_id):
     if not data: flash("Quiz not found", "danger"); return redirect(url_for("student_dashboard"))
     quiz = data["quiz"]; questions = data["questions"]
     if request.method == "POST":
-        answers = []
-        total_points = 0
-        earned = 0
-        for q in questions:
-            qid = q["id"]
-            choice = request.form.get(f"q_{qid}")
-            ch_index = int(choice) if choice is not None else None
-            answers.append(ch_index)
-            total_points += q["points"]
-            if ch_index is not None and ch_index == q["answer_index"]:
-                earned += q["points"]
-        score_percent = round((earned / total_points) * 100, 2) if total_points else 0.0
+        choices = [request.form.get(f"q_{q['id']}") for q in questions]
+        answers = [int(c) if c is not None else None for c in choices]
+        score_percent = score_answers(questions, answers)
         DB.save_submission(quiz_id, current_user.id, answers, score_percent)
         flash(f"Submitted. Score: {score_percent}%", "success")
         return redirect(url_for("student_dashboard"))
@@ -335,7 +512,7 @@ def take_quiz(quiz_id):
         qlist.append({
             "id": q["id"],
             "text": q["question_text"],
-            "choices": json.loads(q["choices"]),
+            "choices_html": render_choices_html(q["id"], q["choices_json"]),
             "points": q["points"]
         })
     return render_template("quiz_take.html", quiz=quiz, questions=qlist)
@@ -346,7 +523,7 @@ def quiz_results(quiz_id):
     data = DB.get_quiz(quiz_id)
     if not data: flash("Quiz not found", "danger"); return redirect(url_for("index"))
     # tutors can see all, students only their own
-    subs = DB.get_submissions_for_quiz(quiz_id) if current_user.role == "tutor" else [s for s in DB.get_submissions_for_quiz(quiz_id) if s["student_id"] == current_user.id]
+    subs = DB.get_submissions_for_quiz(quiz_id, student_id=None if current_user.role == "tutor" else current_user.id)
     return render_template("quiz_results.html", quiz=data["quiz"], questions=data["questions"], submissions=subs)
 
 # -----------------------
@@ -354,25 +531,29 @@ def quiz_results(quiz_id):
 # -----------------------
 @app.cli.command("init-db")
 def init_db_cmd():
-    # create DB and optionally seed admin with password from env
-    DB.init_db(seed=True)
+    # create DB and optionally seed admin with password from env; run once at deploy
+    DB.init_db(seed=True, force=True)
     # if ADMIN_PASSWORD env set, update admin user with password
     admin_pw = os.environ.get("CLASSROOM_ADMIN_PW")
     if admin_pw:
         # set first admin's password (simple approach)
-        conn = DB.get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM users WHERE role='admin' LIMIT 1")
-        r = cur.fetchone()
-        if r:
-            from werkzeug.security import generate_password_hash
-            cur.execute("UPDATE users SET password_hash=? WHERE id=?", (generate_password_hash(admin_pw), r["id"]))
-            conn.commit()
-        conn.close()
+        admin_id = DB.get_first_admin_id()
+        if admin_id is not None:
+            DB.set_password_hash(admin_id, hash_password(admin_pw))
     print("DB initialized. If you provided CLASSROOM_ADMIN_PW environment variable, admin password set.")
 
+@app.cli.command("compile-templates")
+def compile_templates_cmd():
+    # build step: write templates/ as compiled modules for ModuleLoader
+    target = COMPILED_TEMPLATES or "compiled_templates.zip"
+    env = app.jinja_env.overlay(loader=_file_loader)
+    env.compile_templates(target, extensions=["html"], zip="deflated", ignore_errors=False)
+    print(f"Templates compiled to {target}. Set CLASSROOM_COMPILED_TEMPLATES={target} to load them.")
+
 if __name__ == "__main__":
-    # create DB file if not exists (for quick dev)
-    if not os.path.exists(DB.DB_PATH):
-        DB.init_db(seed=True)
-    app.run(debug=True, port=5000)
+    # seed the admin account on first run (for quick dev); the schema itself
+    # was already migrated at import
+    DB.init_db(seed=True)
+    # debug mode (reloader, debugger, template mtime checks) is opt-in;
+    # in production serve with e.g. `gunicorn -w N app:app`
+    app.run(debug=os.environ.get("CLASSROOM_DEBUG") == "1", port=5000)
@@ -1,25 +1,187 @@
 # db.py
 import sqlite3
 import json
+import csv
+import io
 import os
+import queue
+import threading
+import time
 from datetime import datetime
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 
+try:
+    import orjson  # optional: much faster JSON encode/decode
+except ImportError:
+    orjson = None
+
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 DB_PATH = os.path.join(BASE_DIR, "classroom.db")
 
-def get_connection():
+# Hot queries as shared constants: sqlite3 keeps compiled statements in a
+# per-connection cache keyed by SQL text, so identical text is parsed and
+# planned once per connection and then reused.
+SQL_FIRST_ADMIN = "SELECT id FROM users WHERE role='admin' LIMIT 1"
+SQL_USER_BY_EMAIL = "SELECT * FROM users WHERE email = ?"
+SQL_USER_BY_ID = "SELECT id, name, email, role FROM users WHERE id = ?"
+# Quiz listings and the take/results pages never need the cached
+# questions_json_pretty text, so project it away everywhere but the editor.
+QUIZ_COLUMNS = "id, class_id, title, description, created_by, created_at"
+Q_QUIZ_COLUMNS = "q.id, q.class_id, q.title, q.description, q.created_by, q.created_at"
+# The quiz row plus its questions as one JSON array, in a single round-trip.
+# choices stay as their stored JSON text so _parse_choices() can cache them.
+SQL_QUIZ_WITH_QUESTIONS = f"""
+  SELECT {QUIZ_COLUMNS},
+         (SELECT json_group_array(json_object(
+                   'id', qs.id, 'question_text', qs.question_text, 'choices', qs.choices,
+                   'answer_index', qs.answer_index, 'points', qs.points))
+          FROM (SELECT * FROM questions WHERE quiz_id = quizzes.id ORDER BY id) qs) AS questions_json
+  FROM quizzes WHERE id = ?
+"""
+SQL_QUESTIONS_FOR_QUIZ = "SELECT id, question_text, choices, answer_index, points FROM questions WHERE quiz_id = ?"
+SQL_INSERT_QUESTION = "INSERT INTO questions (quiz_id,question_text,choices,answer_index,points) VALUES (?,?,?,?,?)"
+# re-marking a student on the same day replaces that day's mark (ux_attendance_day)
+SQL_UPSERT_ATTENDANCE = """
+  INSERT INTO attendance (class_id,student_id,status,reason,marked_by,marked_at) VALUES (?,?,?,?,?,?)
+  ON CONFLICT(class_id, student_id, date(marked_at)) DO UPDATE SET
+    status=excluded.status, reason=excluded.reason, marked_by=excluded.marked_by, marked_at=excluded.marked_at
+"""
+
+# Stored in PRAGMA user_version; bump when _create_schema() or _migrate() changes.
+SCHEMA_VERSION = 3
+
+# Long-lived connections are pooled so requests skip connect() + PRAGMA setup
+# and find SQLite's page cache (and statement cache) already warm. LIFO hands
+# out the most recently used, hottest connection first.
+POOL_SIZE = int(os.environ.get("CLASSROOM_DB_POOL", "8"))
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+# Per-thread request scope: while a scope is open every helper shares one
+# pooled connection.
+_scope = threading.local()
+
+# Applied to every new pooled connection. journal_mode is persistent in the
+# file, but init_db() skips DDL on current databases, so re-assert it here.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA foreign_keys = ON;",
+    "PRAGMA synchronous = NORMAL;",  # durable enough with WAL, far fewer fsyncs
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA mmap_size = 268435456;",  # reads served from the page cache, no read() copies
+    "PRAGMA cache_size = -65536;",  # 64 MiB page cache keeps dashboard tables/indexes hot
+)
+
+def _connect():
     # wait up to 5 seconds for a lock before failing
-    conn = sqlite3.connect(DB_PATH, timeout=5, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    # pooled connections keep their compiled-statement cache across requests;
+    # size it well above the number of distinct statements in this module
+    conn = sqlite3.connect(DB_PATH, timeout=5, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+                           cached_statements=256)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+def _acquire():
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _connect()
+
+def _return_to_pool(conn):
+    # same outcome as closing: drop anything the borrower left uncommitted
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
 
-def init_db(seed: bool = False):
-    """Create schema and optionally seed with basic admin/tutor/student and sample data."""
-    conn = get_connection()
-    conn.execute("PRAGMA journal_mode=WAL;")  # Better read/write concurrency
+def get_connection():
+    """Return the connection of the open request scope, or a pooled one outside it."""
+    if not getattr(_scope, "active", False):
+        return _acquire()
+    if _scope.conn is None:
+        _scope.conn = _acquire()
+    return _scope.conn
+
+def release_connection(conn):
+    """Counterpart of get_connection(): returns standalone connections to the pool, keeps the scoped one."""
+    if getattr(_scope, "active", False) and conn is _scope.conn:
+        if conn.in_transaction:
+            conn.rollback()
+        return
+    _return_to_pool(conn)
+
+def open_request_scope():
+    """Share one lazily-acquired connection between helper calls until close_request_scope()."""
+    _scope.active = True
+    _scope.conn = None
+    _scope.cache = {}
+    _scope.cache_changes = None
+    _scope.now = None
+
+def close_request_scope():
+    conn = getattr(_scope, "conn", None)
+    _scope.active = False
+    _scope.conn = None
+    _scope.cache = {}
+    _scope.now = None
+    if conn is not None:
+        _return_to_pool(conn)
+
+def _utcnow() -> str:
+    """ISO timestamp for created_at/marked_at columns; computed once per request scope."""
+    if not getattr(_scope, "active", False):
+        return datetime.utcnow().isoformat()
+    if _scope.now is None:
+        _scope.now = datetime.utcnow().isoformat()
+    return _scope.now
+
+def json_dumps(obj, pretty: bool = False) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0).decode()
+    return json.dumps(obj, indent=2 if pretty else None)
+
+def json_loads(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def init_db(seed: bool = False, force: bool = False):
+    """Create schema and optionally seed with basic admin/tutor/student and sample data.
+
+    Databases already at SCHEMA_VERSION skip all DDL, so calling this on every
+    process start costs a single PRAGMA read; pass force=True to rebuild anyway.
+    """
+    # a private connection, closed before returning: init_db() runs at import,
+    # and a pooled connection would be inherited by every forked worker
+    # (gunicorn --preload), which SQLite forbids
+    conn = _connect()
+    try:
+        cur = conn.cursor()
+        if force or conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            _create_schema(conn)
+
+        if seed:
+            # check if admin exists
+            cur.execute(SQL_FIRST_ADMIN)
+            if cur.fetchone():
+                return
+            ts = _utcnow()
+            # basic password hashes will be inserted by app CLI in practice; placeholder required
+            # To seed properly via script, we accept password hashes passed from caller.
+            # But for convenience we'll place empty string for now and instruct user to use CLI to set admin.
+            cur.execute("INSERT INTO users (name,email,password_hash,role,created_at) VALUES (?,?,?,?,?)",
+                        ("Admin User","admin@example.com","", "admin", ts))
+            # We will not create other sample rows with empty password_hash.
+            conn.commit()
+    finally:
+        conn.close()
+
+def _create_schema(conn):
     cur = conn.cursor()
     # Users
     cur.executescript("""
@@ -58,6 +220,7 @@ def init_db(seed: bool = False):
       description TEXT,
       created_by INTEGER NOT NULL,
       created_at TEXT NOT NULL,
+      questions_json_pretty TEXT, -- edit form payload, rebuilt on every write
       FOREIGN KEY(class_id) REFERENCES classes(id) ON DELETE CASCADE,
       FOREIGN KEY(created_by) REFERENCES users(id) ON DELETE SET NULL
     );
@@ -95,214 +258,359 @@ def init_db(seed: bool = False):
       FOREIGN KEY(student_id) REFERENCES users(id) ON DELETE CASCADE,
       FOREIGN KEY(marked_by) REFERENCES users(id) ON DELETE CASCADE
     );
+
+    -- foreign keys every dashboard query filters or joins on.
+    -- enrollments(class_id, ...) is already covered by its UNIQUE index and
+    -- submissions(quiz_id) by the composite below.
+    CREATE INDEX IF NOT EXISTS idx_classes_tutor ON classes(tutor_id);
+    CREATE INDEX IF NOT EXISTS idx_enrollments_user ON enrollments(user_id);
+    CREATE INDEX IF NOT EXISTS idx_quizzes_class ON quizzes(class_id);
+    CREATE INDEX IF NOT EXISTS idx_questions_quiz ON questions(quiz_id);
+    -- carries score so the per-quiz AVG/COUNT on the tutor dashboard is index-only
+    DROP INDEX IF EXISTS idx_submissions_quiz_student;
+    CREATE INDEX IF NOT EXISTS idx_submissions_quiz_student_score ON submissions(quiz_id, student_id, score);
+    CREATE INDEX IF NOT EXISTS idx_submissions_student ON submissions(student_id);
+    -- class attendance pages/exports list newest first; the second index serves
+    -- the dashboard roster join on (student, class) and per-student summaries
+    CREATE INDEX IF NOT EXISTS idx_attendance_class_marked ON attendance(class_id, marked_at DESC);
+    CREATE INDEX IF NOT EXISTS idx_attendance_student_class ON attendance(student_id, class_id, status);
     """)
     conn.commit()
+    _migrate(conn)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
 
-    if seed:
-        # check if admin exists
-        cur.execute("SELECT id FROM users WHERE role='admin' LIMIT 1;")
-        if cur.fetchone():
-            conn.close()
-            return
-        ts = datetime.utcnow().isoformat()
-        # basic password hashes will be inserted by app CLI in practice; placeholder required
-        # To seed properly via script, we accept password hashes passed from caller.
-        # But for convenience we'll place empty string for now and instruct user to use CLI to set admin.
-        cur.execute("INSERT INTO users (name,email,password_hash,role,created_at) VALUES (?,?,?,?,?)",
-                    ("Admin User","admin@example.com","", "admin", ts))
-        # We will not create other sample rows with empty password_hash.
+def _column_exists(conn, table: str, column: str) -> bool:
+    return any(r["name"] == column for r in conn.execute(f"PRAGMA table_info({table})"))
+
+def _index_exists(conn, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name=?", (name,)).fetchone() is not None
+
+def _migrate(conn):
+    """Bring a database created by an older version up to the current schema."""
+    # every step re-checks before acting: several workers may start at once
+    if not _column_exists(conn, "quizzes", "questions_json_pretty"):
+        try:
+            conn.execute("ALTER TABLE quizzes ADD COLUMN questions_json_pretty TEXT")
+        except sqlite3.OperationalError:
+            if not _column_exists(conn, "quizzes", "questions_json_pretty"):
+                raise
+        for quiz in conn.execute("SELECT id FROM quizzes").fetchall():
+            questions = conn.execute(SQL_QUESTIONS_FOR_QUIZ, (quiz["id"],)).fetchall()
+            conn.execute("UPDATE quizzes SET questions_json_pretty=? WHERE id=?",
+                         (_pretty_questions(_parse_question(q) for q in questions), quiz["id"]))
         conn.commit()
-    conn.close()
+    if not _index_exists(conn, "ux_attendance_day"):
+        # one mark per student per class per day: the latest of any duplicates
+        # stays in attendance, the marks it supersedes move to attendance_archive
+        # (same columns and ids) so no history is lost
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not _index_exists(conn, "ux_attendance_day"):
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS attendance_archive (
+                      id INTEGER PRIMARY KEY,
+                      class_id INTEGER NOT NULL,
+                      student_id INTEGER NOT NULL,
+                      status TEXT NOT NULL,
+                      reason TEXT,
+                      marked_by INTEGER NOT NULL,
+                      marked_at TEXT NOT NULL
+                    )
+                """)
+                superseded = """
+                    FROM attendance WHERE id NOT IN (
+                      SELECT MAX(id) FROM attendance GROUP BY class_id, student_id, date(marked_at)
+                    )
+                """
+                conn.execute("INSERT OR IGNORE INTO attendance_archive "
+                             "SELECT id, class_id, student_id, status, reason, marked_by, marked_at " + superseded)
+                conn.execute("DELETE " + superseded)
+                conn.execute("CREATE UNIQUE INDEX ux_attendance_day ON attendance(class_id, student_id, date(marked_at))")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
 # helper functions used by app.py
 def create_user(name, email, password_hash, role):
     conn = get_connection()
     try:
         cur = conn.cursor()
-        ts = datetime.utcnow().isoformat()
+        ts = _utcnow()
         cur.execute(
             "INSERT INTO users (name,email,password_hash,role,created_at) VALUES (?,?,?,?,?)",
             (name, email, password_hash, role, ts)
         )
         conn.commit()
+        invalidate_user_cache(email=email)
         return cur.lastrowid
     finally:
-        conn.close()
+        release_connection(conn)
 
 
-def get_user_by_email(email: str) -> Optional[sqlite3.Row]:
+def _query(sql: str, params=(), one: bool = False):
+    """
+    Run a read-only query and return all rows (or the first row if `one`).
+    Inside a request scope identical reads are answered from a per-request
+    cache, which is dropped as soon as the scoped connection writes anything.
+    """
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE email = ?", (email,))
-    row = cur.fetchone()
-    conn.close()
+    try:
+        scoped = getattr(_scope, "active", False) and conn is _scope.conn
+        key = (sql, tuple(params), one)
+        if scoped:
+            if _scope.cache_changes != conn.total_changes:
+                _scope.cache.clear()
+                _scope.cache_changes = conn.total_changes
+            if key in _scope.cache:
+                return _scope.cache[key]
+        cur = conn.execute(sql, params)
+        result = cur.fetchone() if one else cur.fetchall()
+        if scoped:
+            _scope.cache[key] = result
+        return result
+    finally:
+        release_connection(conn)
+
+def get_user_by_email(email: str) -> Optional[sqlite3.Row]:
+    return _query(SQL_USER_BY_EMAIL, (email,), one=True)
+
+# Short-lived cache for login lookups: absorbs bursts of attempts against the
+# same email (e.g. credential stuffing) without a SELECT each time. Unknown
+# emails and accounts without a password are never cached: invalidation only
+# reaches this process, and an account created (or given its first password,
+# e.g. by `flask init-db`) elsewhere must be able to log in right away.
+USER_CACHE_TTL = 30
+USER_CACHE_MAX = 1024
+_user_cache: Dict[str, tuple] = {}  # email -> (expires_at, row)
+_user_cache_lock = threading.Lock()
+
+def get_user_by_email_cached(email: str) -> Optional[sqlite3.Row]:
+    now = time.monotonic()
+    with _user_cache_lock:
+        hit = _user_cache.get(email)
+        if hit and hit[0] > now:
+            return hit[1]
+    row = get_user_by_email(email)
+    if row is None or not row["password_hash"]:
+        return row
+    with _user_cache_lock:
+        _user_cache.pop(email, None)
+        if len(_user_cache) >= USER_CACHE_MAX:
+            # entries are kept in insertion order, so the first is the oldest
+            _user_cache.pop(next(iter(_user_cache)))
+        _user_cache[email] = (now + USER_CACHE_TTL, row)
     return row
 
+def invalidate_user_cache(email: Optional[str] = None, uid: Optional[int] = None) -> None:
+    with _user_cache_lock:
+        if email is not None:
+            _user_cache.pop(email, None)
+        if uid is not None:
+            for key, (_, row) in list(_user_cache.items()):
+                if row["id"] == uid:
+                    del _user_cache[key]
+
 def get_user_by_id(uid: int) -> Optional[sqlite3.Row]:
+    return _query(SQL_USER_BY_ID, (uid,), one=True)
+
+def get_first_admin_id() -> Optional[int]:
+    row = _query(SQL_FIRST_ADMIN, one=True)
+    return row["id"] if row else None
+
+def set_password_hash(uid: int, password_hash: str) -> None:
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE id = ?", (uid,))
-    r = cur.fetchone()
-    conn.close()
-    return r
+    try:
+        conn.execute("UPDATE users SET password_hash=? WHERE id=?", (password_hash, uid))
+        conn.commit()
+        invalidate_user_cache(uid=uid)
+    finally:
+        release_connection(conn)
 
 def create_class(title: str, description: str, tutor_id: int) -> int:
     conn = get_connection()
     cur = conn.cursor()
-    ts = datetime.utcnow().isoformat()
+    ts = _utcnow()
     cur.execute("INSERT INTO classes (title,description,tutor_id,created_at) VALUES (?,?,?,?)",
                 (title, description, tutor_id, ts))
     cid = cur.lastrowid
     conn.commit()
-    conn.close()
+    release_connection(conn)
+    invalidate_dashboard_cache()
     return cid
 
 def enroll_student(class_id: int, student_id: int) -> None:
     conn = get_connection()
     cur = conn.cursor()
-    ts = datetime.utcnow().isoformat()
+    ts = _utcnow()
     try:
         cur.execute("INSERT INTO enrollments (class_id,user_id,enrolled_at) VALUES (?,?,?)",
                     (class_id, student_id, ts))
         conn.commit()
+        invalidate_dashboard_cache()
     except sqlite3.IntegrityError:
         pass
     finally:
-        conn.close()
+        release_connection(conn)
 
 def get_classes_for_tutor(tutor_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM classes WHERE tutor_id = ?", (tutor_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return _query("SELECT * FROM classes WHERE tutor_id = ?", (tutor_id,))
 
 def get_students_in_class(class_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-      SELECT u.* FROM users u
+    return _query("""
+      SELECT u.id, u.name, u.email FROM users u
       JOIN enrollments e ON e.user_id = u.id
       WHERE e.class_id = ? AND u.role = 'student'
     """, (class_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+
+def _insert_questions(cur, quiz_id: int, questions: List[Dict[str,Any]]):
+    """Insert all of a quiz's questions with one executemany call."""
+    cur.executemany(SQL_INSERT_QUESTION, [
+        (quiz_id, q["question_text"], json_dumps(q["choices"]), q["answer_index"], q.get("points",1))
+        for q in questions
+    ])
 
 def create_quiz(class_id: int, title: str, description: str, created_by: int, questions: List[Dict[str,Any]]):
     conn = get_connection()
-    cur = conn.cursor()
-    ts = datetime.utcnow().isoformat()
-    cur.execute("INSERT INTO quizzes (class_id,title,description,created_by,created_at) VALUES (?,?,?,?,?)",
-                (class_id, title, description, created_by, ts))
-    qid = cur.lastrowid
-    for q in questions:
-        cur.execute("INSERT INTO questions (quiz_id,question_text,choices,answer_index,points) VALUES (?,?,?,?,?)",
-                    (qid, q["question_text"], json.dumps(q["choices"]), q["answer_index"], q.get("points",1)))
-    conn.commit()
-    conn.close()
+    ts = _utcnow()
+    try:
+        # quiz row and questions land in one transaction (one commit)
+        with conn:
+            cur = conn.cursor()
+            cur.execute("INSERT INTO quizzes (class_id,title,description,created_by,created_at,questions_json_pretty) VALUES (?,?,?,?,?,?)",
+                        (class_id, title, description, created_by, ts, _pretty_questions(questions)))
+            qid = cur.lastrowid
+            _insert_questions(cur, qid, questions)
+    finally:
+        release_connection(conn)
+    invalidate_dashboard_cache()
     return qid
 
 def get_quizzes_for_class(class_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM quizzes WHERE class_id = ?", (class_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return _query(f"SELECT {QUIZ_COLUMNS} FROM quizzes WHERE class_id = ?", (class_id,))
+
+def get_quiz_row(quiz_id: int) -> Optional[sqlite3.Row]:
+    """The full quizzes row (including questions_json_pretty), without its questions."""
+    return _query("SELECT * FROM quizzes WHERE id = ?", (quiz_id,), one=True)
 
 def get_quiz(quiz_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM quizzes WHERE id = ?", (quiz_id,))
-    quiz = cur.fetchone()
+    quiz = _query(SQL_QUIZ_WITH_QUESTIONS, (quiz_id,), one=True)
     if not quiz:
-        conn.close()
         return None
-    cur.execute("SELECT * FROM questions WHERE quiz_id = ?", (quiz_id,))
-    questions = cur.fetchall()
-    conn.close()
+    questions = [_parse_question(q) for q in json_loads(quiz["questions_json"])]
     return {"quiz": quiz, "questions": questions}
 
+@lru_cache(maxsize=4096)
+def _parse_choices(raw: str) -> tuple:
+    # keyed by the stored JSON text itself, so an edited quiz can never be
+    # served stale choices (in this or any other worker process)
+    return tuple(json_loads(raw))
+
+def _parse_question(row) -> Dict[str, Any]:
+    """Question row (or decoded JSON object) as a dict with `choices` already decoded.
+
+    The stored text is kept as `choices_json` for callers that need a hashable key.
+    """
+    q = dict(row)
+    q["choices_json"] = row["choices"]
+    q["choices"] = _parse_choices(row["choices"])
+    return q
+
+def _pretty_questions(questions) -> str:
+    """Indented JSON of the editable question fields, as shown in the edit form."""
+    return json_dumps([
+        {
+            "question_text": q["question_text"],
+            "choices": list(q["choices"]),
+            "answer_index": q["answer_index"],
+            "points": q.get("points", 1)
+        }
+        for q in questions
+    ], pretty=True)
+
 def update_quiz(quiz_id: int, title: str, description: str, questions: List[Dict[str,Any]]):
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE quizzes SET title=?, description=? WHERE id=?", (title, description, quiz_id))
-    # naive approach: delete existing questions and re-insert; simple and safe for demo
-    cur.execute("DELETE FROM questions WHERE quiz_id = ?", (quiz_id,))
-    for q in questions:
-        cur.execute("INSERT INTO questions (quiz_id,question_text,choices,answer_index,points) VALUES (?,?,?,?,?)",
-                    (quiz_id, q["question_text"], json.dumps(q["choices"]), q["answer_index"], q.get("points",1)))
-    conn.commit()
-    conn.close()
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE quizzes SET title=?, description=?, questions_json_pretty=? WHERE id=?",
+                        (title, description, _pretty_questions(questions), quiz_id))
+            # naive approach: delete existing questions and re-insert; simple and safe for demo
+            cur.execute("DELETE FROM questions WHERE quiz_id = ?", (quiz_id,))
+            _insert_questions(cur, quiz_id, questions)
+    finally:
+        release_connection(conn)
+    invalidate_dashboard_cache()
 
 def save_submission(quiz_id: int, student_id: int, answers: List[Optional[int]], score: float):
     conn = get_connection()
     cur = conn.cursor()
-    ts = datetime.utcnow().isoformat()
+    ts = _utcnow()
     cur.execute("INSERT INTO submissions (quiz_id, student_id, answers, score, submitted_at) VALUES (?,?,?,?,?)",
-                (quiz_id, student_id, json.dumps(answers), score, ts))
+                (quiz_id, student_id, json_dumps(answers), score, ts))
     conn.commit()
-    conn.close()
+    release_connection(conn)
+    invalidate_dashboard_cache()
 
-def get_submissions_for_quiz(quiz_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
+def get_submissions_for_quiz(quiz_id: int, student_id: Optional[int] = None):
+    """Submissions for a quiz, best first; only `student_id`'s own when given."""
+    sql = """
       SELECT s.*, u.name as student_name, u.email as student_email
       FROM submissions s JOIN users u ON u.id = s.student_id
       WHERE s.quiz_id = ?
-      ORDER BY s.score DESC
-    """, (quiz_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    """
+    params = [quiz_id]
+    if student_id is not None:
+        sql += " AND s.student_id = ?"
+        params.append(student_id)
+    return _query(sql + " ORDER BY s.score DESC", params)
 
 def mark_attendance(class_id: int, student_id: int, status: str, reason: Optional[str], marked_by: int):
     conn = get_connection()
     cur = conn.cursor()
-    ts = datetime.utcnow().isoformat()
-    # remove previous attendance for same student/class on same day? For simplicity we just insert
-    cur.execute("INSERT INTO attendance (class_id,student_id,status,reason,marked_by,marked_at) VALUES (?,?,?,?,?,?)",
-                (class_id, student_id, status, reason, marked_by, ts))
+    ts = _utcnow()
+    cur.execute(SQL_UPSERT_ATTENDANCE, (class_id, student_id, status, reason, marked_by, ts))
     conn.commit()
-    conn.close()
+    release_connection(conn)
+    invalidate_dashboard_cache()
 
-def get_attendance_for_class(class_id: int):
+def mark_attendance_bulk(class_id: int, marked_by: int, entries: List[tuple]):
+    """Record attendance for many students in one transaction; entries are (student_id, status, reason)."""
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
+    ts = _utcnow()
+    try:
+        with conn:
+            conn.executemany(
+                SQL_UPSERT_ATTENDANCE,
+                [(class_id, sid, status, reason, marked_by, ts) for sid, status, reason in entries]
+            )
+    finally:
+        release_connection(conn)
+    invalidate_dashboard_cache()
+
+def get_attendance_for_class(class_id: int):
+    return _query("""
       SELECT a.*, u.name as student_name FROM attendance a
       JOIN users u ON u.id = a.student_id
       WHERE a.class_id = ?
       ORDER BY a.marked_at DESC
     """, (class_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
 def get_classes_for_student(student_id: int):
     """Return all classes a student is enrolled in with tutor info."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
+    return _query("""
       SELECT c.*, u.name AS tutor_name, u.email AS tutor_email
       FROM classes c
       JOIN enrollments e ON e.class_id = c.id
       JOIN users u ON u.id = c.tutor_id
       WHERE e.user_id = ?
     """, (student_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
 
 def get_student_attendance_summary(student_id: int):
     """Summarize attendance counts for a student across all classes."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
+    return _query("""
       SELECT c.title AS class_title,
              SUM(CASE WHEN a.status='present' THEN 1 ELSE 0 END) AS presents,
              SUM(CASE WHEN a.status='absent' THEN 1 ELSE 0 END) AS absents,
@@ -312,17 +620,12 @@ def get_student_attendance_summary(student_id: int):
       WHERE a.student_id = ?
       GROUP BY c.id
     """, (student_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
 
 def get_quizzes_for_student(student_id: int):
     """List quizzes for all classes the student is enrolled in, with submission info."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-      SELECT q.*, c.title AS class_title, c.id AS class_id, s.score AS score
+    return _query(f"""
+      SELECT {Q_QUIZ_COLUMNS}, c.title AS class_title, s.score AS score
       FROM quizzes q
       JOIN classes c ON c.id = q.class_id
       JOIN enrollments e ON e.class_id = c.id
@@ -330,60 +633,45 @@ def get_quizzes_for_student(student_id: int):
       WHERE e.user_id = ?
       ORDER BY q.created_at DESC
     """, (student_id, student_id))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
 
 def get_all_classes_with_students_and_quizzes():
     """Admin convenience: all classes with tutors, enrolled students count, and quiz count."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
+    return _query("""
       SELECT c.id, c.title, c.description,
              u.name AS tutor_name,
-             (SELECT COUNT(*) FROM enrollments e WHERE e.class_id = c.id) AS student_count,
-             (SELECT COUNT(*) FROM quizzes q WHERE q.class_id = c.id) AS quiz_count
+             COALESCE(e.n, 0) AS student_count,
+             COALESCE(qz.n, 0) AS quiz_count
       FROM classes c
       JOIN users u ON u.id = c.tutor_id
+      LEFT JOIN (SELECT class_id, COUNT(*) AS n FROM enrollments GROUP BY class_id) e ON e.class_id = c.id
+      LEFT JOIN (SELECT class_id, COUNT(*) AS n FROM quizzes GROUP BY class_id) qz ON qz.class_id = c.id
       ORDER BY c.created_at DESC
     """)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
 def get_student_attendance(student_id: int):
     """
     Return all attendance records for a specific student, joined with class info.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
+    return _query("""
         SELECT a.*, c.title AS class_title
         FROM attendance a
         JOIN classes c ON c.id = a.class_id
         WHERE a.student_id = ?
         ORDER BY a.marked_at DESC
     """, (student_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
 def get_attendance_summary(class_id: int):
     """
     Summarize attendance counts per status for a class.
     Returns: {'present': X, 'absent': Y, 'justified': Z}
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
+    rows = _query("""
         SELECT status, COUNT(*) AS count
         FROM attendance
         WHERE class_id = ?
         GROUP BY status
     """, (class_id,))
-    rows = cur.fetchall()
-    conn.close()
     summary = {'present': 0, 'absent': 0, 'justified': 0}
     for r in rows:
         summary[r['status']] = r['count']
@@ -391,55 +679,166 @@ def get_attendance_summary(class_id: int):
 
 def get_average_score(quiz_id: int) -> float:
     """Return the average score for a quiz. Returns 0.0 if no submissions."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT AVG(score) AS avg_score FROM submissions WHERE quiz_id = ?", (quiz_id,))
-    row = cur.fetchone()
-    conn.close()
+    row = _query("SELECT AVG(score) AS avg_score FROM submissions WHERE quiz_id = ?", (quiz_id,), one=True)
     return row["avg_score"] if row and row["avg_score"] is not None else 0.0
 
 
 def get_student_quizzes(student_id: int):
     """
     Return all quizzes for classes a student is enrolled in, 
-    including their score (if submitted) and class info.
+    including their latest score (if submitted) and class info.
+    One row per quiz, even after resubmissions.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT q.*, c.title AS class_title, s.score AS score, s.submitted_at
+    return _query(f"""
+        SELECT {Q_QUIZ_COLUMNS}, c.title AS class_title, s.score AS score, s.submitted_at
         FROM quizzes q
         JOIN classes c ON c.id = q.class_id
         JOIN enrollments e ON e.class_id = c.id
-        LEFT JOIN submissions s 
-          ON s.quiz_id = q.id AND s.student_id = ?
+        LEFT JOIN submissions s
+          ON s.id = (SELECT MAX(id) FROM submissions WHERE quiz_id = q.id AND student_id = ?)
         WHERE e.user_id = ?
         ORDER BY q.created_at DESC
     """, (student_id, student_id))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
-def count_submissions(quiz_id: int) -> int:
-    """Return the total number of submissions for a quiz."""
+def get_tutor_dashboard_bundle(tutor_id: int):
+    """
+    Everything the tutor dashboard shows, in a fixed number of queries
+    regardless of how many classes/quizzes the tutor has.
+    Returns a list (one entry per class) of
+    {'class', 'students', 'attendance', 'quizzes'} dicts.
+    """
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) AS cnt FROM submissions WHERE quiz_id = ?", (quiz_id,))
-    row = cur.fetchone()
-    conn.close()
+    cur.execute("SELECT * FROM classes WHERE tutor_id = ?", (tutor_id,))
+    bundle = {}
+    for c in cur.fetchall():
+        bundle[c["id"]] = {
+            "class": c,
+            "students": [],
+            "attendance": {'present': 0, 'absent': 0, 'justified': 0},
+            "quizzes": []
+        }
+
+    # roster with per-student attendance counts
+    cur.execute("""
+        SELECT e.class_id, u.id, u.name, u.email,
+               SUM(CASE WHEN a.status='present' THEN 1 ELSE 0 END) AS present,
+               SUM(CASE WHEN a.status='absent' THEN 1 ELSE 0 END) AS absent,
+               SUM(CASE WHEN a.status='justified' THEN 1 ELSE 0 END) AS justified
+        FROM classes c
+        JOIN enrollments e ON e.class_id = c.id
+        JOIN users u ON u.id = e.user_id AND u.role = 'student'
+        LEFT JOIN attendance a ON a.class_id = e.class_id AND a.student_id = u.id
+        WHERE c.tutor_id = ?
+        GROUP BY e.class_id, u.id
+    """, (tutor_id,))
+    for r in cur.fetchall():
+        bundle[r["class_id"]]["students"].append(r)
+
+    cur.execute("""
+        SELECT a.class_id, a.status, COUNT(*) AS count
+        FROM attendance a
+        JOIN classes c ON c.id = a.class_id
+        WHERE c.tutor_id = ?
+        GROUP BY a.class_id, a.status
+    """, (tutor_id,))
+    for r in cur.fetchall():
+        bundle[r["class_id"]]["attendance"][r["status"]] = r["count"]
+
+    cur.execute(f"""
+        SELECT {Q_QUIZ_COLUMNS}, COALESCE(AVG(s.score), 0.0) AS avg_score, COUNT(s.id) AS num_submissions
+        FROM quizzes q
+        JOIN classes c ON c.id = q.class_id
+        LEFT JOIN submissions s ON s.quiz_id = q.id
+        WHERE c.tutor_id = ?
+        GROUP BY q.id
+    """, (tutor_id,))
+    for r in cur.fetchall():
+        bundle[r["class_id"]]["quizzes"].append({
+            "quiz": r,
+            "avg_score": r["avg_score"],
+            "num_submissions": r["num_submissions"]
+        })
+    release_connection(conn)
+    return list(bundle.values())
+
+# The dashboard aggregates change only when someone writes. The write helpers
+# above clear this cache, but only in their own process: with several workers
+# (gunicorn -w N) another worker may serve a bundle up to TTL seconds old, e.g.
+# a dashboard that doesn't list the quiz just created on a different worker.
+DASHBOARD_CACHE_TTL = 30
+_dashboard_cache: Dict[int, tuple] = {}  # tutor_id -> (expires_at, bundle)
+_dashboard_cache_lock = threading.Lock()
+# bumped on every invalidation; a bundle built across a bump may predate the
+# write and is not stored
+_dashboard_cache_gen = 0
+
+def get_tutor_dashboard_bundle_cached(tutor_id: int):
+    now = time.monotonic()
+    with _dashboard_cache_lock:
+        hit = _dashboard_cache.get(tutor_id)
+        if hit and hit[0] > now:
+            return hit[1]
+        gen = _dashboard_cache_gen
+    bundle = get_tutor_dashboard_bundle(tutor_id)
+    with _dashboard_cache_lock:
+        if gen == _dashboard_cache_gen:
+            _dashboard_cache[tutor_id] = (now + DASHBOARD_CACHE_TTL, bundle)
+    return bundle
+
+def invalidate_dashboard_cache() -> None:
+    global _dashboard_cache_gen
+    with _dashboard_cache_lock:
+        _dashboard_cache_gen += 1
+        _dashboard_cache.clear()
+
+def count_submissions(quiz_id: int) -> int:
+    """Return the total number of submissions for a quiz."""
+    row = _query("SELECT COUNT(*) AS cnt FROM submissions WHERE quiz_id = ?", (quiz_id,), one=True)
     return row["cnt"] if row else 0
 
 
-def export_submissions_csv(quiz_id: int) -> str:
-    rows = get_submissions_for_quiz(quiz_id)
-    lines = ["student_name,student_email,score,submitted_at"]
-    for r in rows:
-        lines.append(f"{r['student_name']},{r['student_email']},{r['score']},{r['submitted_at']}")
-    return "\n".join(lines)
+CSV_BATCH_SIZE = 500
 
-def export_attendance_csv(class_id: int) -> str:
-    rows = get_attendance_for_class(class_id)
-    lines = ["student_name,status,reason,marked_by,marked_at"]
-    for r in rows:
-        lines.append(f"{r['student_name']},{r['status']},{(r['reason'] or '')},{r['marked_by']},{r['marked_at']}")
-    return "\n".join(lines)
+def _csv_chunks(header, cur, batch_size: int = CSV_BATCH_SIZE):
+    """Yield properly quoted CSV text, one chunk per `batch_size` rows fetched from cur."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(header)
+    while True:
+        rows = cur.fetchmany(batch_size)
+        writer.writerows(rows)
+        yield buf.getvalue()
+        if len(rows) < batch_size:
+            return
+        buf.seek(0)
+        buf.truncate()
+
+def export_submissions_csv(quiz_id: int):
+    """Yield the submissions CSV in chunks, reading rows lazily off the cursor."""
+    conn = get_connection()
+    try:
+        cur = conn.execute("""
+          SELECT u.name AS student_name, u.email AS student_email, s.score, s.submitted_at
+          FROM submissions s JOIN users u ON u.id = s.student_id
+          WHERE s.quiz_id = ?
+          ORDER BY s.score DESC
+        """, (quiz_id,))
+        yield from _csv_chunks(["student_name", "student_email", "score", "submitted_at"], cur)
+    finally:
+        release_connection(conn)
+
+def export_attendance_csv(class_id: int):
+    """Yield the attendance CSV in chunks, reading rows lazily off the cursor."""
+    conn = get_connection()
+    try:
+        cur = conn.execute("""
+          SELECT u.name AS student_name, a.status, COALESCE(a.reason, '') AS reason, a.marked_by, a.marked_at
+          FROM attendance a
+          JOIN users u ON u.id = a.student_id
+          WHERE a.class_id = ?
+          ORDER BY a.marked_at DESC
+        """, (class_id,))
+        yield from _csv_chunks(["student_name", "status", "reason", "marked_by", "marked_at"], cur)
+    finally:
+        release_connection(conn)